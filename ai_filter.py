@@ -2,22 +2,80 @@
 AI filtering functionality for the Telegram Auto Forwarder.
 Uses OpenRouter API to determine if messages are of interest.
 """
+import asyncio
+import hashlib
 import os
-import requests
-from typing import Optional
+import random
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from typing import List, Optional, Set, Tuple
 
 from logger import logger
 import config
+import json_utils
+from metrics import AI_CACHE, AI_LATENCY, AI_RESULT
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+# Retry policy for rate limits and transient server errors
+MAX_ATTEMPTS = 5
+MAX_RETRY_DELAY = 30
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+class _AdaptiveLimiter:
+    """
+    Concurrency limiter whose limit adapts to rate limiting (AIMD).
+    
+    The limit is halved whenever the provider rate-limits a request and grows
+    back by roughly one slot per limit's worth of successful requests.
+    """
+    
+    def __init__(self, max_limit: int):
+        """
+        Initialize the limiter.
+        
+        Args:
+            max_limit: Maximum number of concurrent requests
+        """
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+    
+    async def __aenter__(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < int(self.limit))
+            self._in_flight += 1
+    
+    async def __aexit__(self, *exc_info) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+    
+    def on_rate_limited(self) -> None:
+        """Multiplicatively decrease the limit after a rate-limited request."""
+        self.limit = max(1.0, self.limit / 2)
+        logger.warning(f"OpenRouter rate limited, concurrency limit lowered to {int(self.limit)}")
+    
+    def on_success(self) -> None:
+        """Additively increase the limit after a successful request."""
+        self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
 
 class AIFilter:
     """Handles AI-based filtering of messages."""
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, max_batch_size: int = 10, max_concurrent: Optional[int] = None):
         """
         Initialize the AI filter.
         
         Args:
             api_key: OpenRouter API key. If None, uses the one from config.
+            max_batch_size: Maximum number of items packed into one batched prompt
+            max_concurrent: Maximum number of concurrent OpenRouter requests. If None, uses the
+                OPENROUTER_MAX_CONCURRENT environment variable or config setting (default 8).
         """
         self.api_key = api_key or config.OPENROUTER_API_KEY
         if not self.api_key:
@@ -25,12 +83,21 @@ class AIFilter:
         
         # AI model configuration
         self.model = "google/gemini-2.0-flash-thinking-exp:free"
+        self.max_batch_size = max_batch_size
         
-        # Prompt template for filtering
-        self.prompt_template = """You are given some content to evaluate, you need to decide if it is of interest to me.
-        Answer with ONLY the word 'True' or the word 'False', nothing else.
-
-        RULES:
+        # HTTP client, created on first use and reused so keep-alive connections
+        # and TLS sessions are shared across calls
+        self._client: Optional[httpx.AsyncClient] = None
+        
+        # Bound concurrent requests to stay within the provider's rate limits
+        if max_concurrent is None:
+            max_concurrent = int(os.environ.get(
+                "OPENROUTER_MAX_CONCURRENT", getattr(config, 'OPENROUTER_MAX_CONCURRENT', 8)
+            ))
+        self._limiter = _AdaptiveLimiter(max_concurrent)
+        
+        # Rules shared by the single and batched prompts
+        rules = """RULES:
         1. If the content is about a event that is only physically in Singapore, return False
         2. If it is a virtual event, then override the previous rule and return True
         3. If it is a event selling tickets, return False
@@ -41,71 +108,303 @@ class AIFilter:
 
         CONTEXT:
         - NTU and NUS are universities in Singapore
+        """
+        
+        # System prompts carrying the static rules, so the provider can cache the
+        # prompt prefix and only the message content changes between calls
+        self.system_prompt = """You are given some content to evaluate, you need to decide if it is of interest to me.
+        Answer with ONLY the word 'True' or the word 'False', nothing else.
+
+        """ + rules
+        
+        # System prompt for filtering several items in one request
+        self.batch_system_prompt = """You are given several items of content to evaluate, you need to decide for each one if it is of interest to me.
+        Return a JSON array of true/false, one per Item, nothing else.
+
+        """ + rules
         
-        Content: {content}"""
+        # Patterns for content the rules decide on their own, checked before calling the model.
+        # Ticket sales, volunteering and NUS orientations are always rejected; virtual events
+        # are accepted, which overrides rejecting events that are only in Singapore.
+        self._reject_re = re.compile(
+            r"\bNUS orientation|\bvolunteer(?:s|ing)?\b"
+            r"|\bbuy tickets?\b|\btickets? (?:are )?(?:now )?on sale\b|\$\d+\s*(?:SGD|per pax)\b",
+            re.IGNORECASE
+        )
+        self._accept_re = re.compile(r"\bvirtual\b|\bonline webinar\b|\bzoom link\b", re.IGNORECASE)
+        self._local_only_re = re.compile(r"\bSingapore only\b", re.IGNORECASE)
+        
+        # Persistent cache of previous classifications, keyed by content hash. SQLite
+        # calls run on a single worker thread so disk I/O never blocks the event loop.
+        self._cache_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ai_cache")
+        self._cache = sqlite3.connect(getattr(config, 'AI_CACHE_FILE', 'ai_cache.sqlite'), check_same_thread=False)
+        self._cache.execute("CREATE TABLE IF NOT EXISTS ai_cache (key TEXT PRIMARY KEY, value INTEGER)")
+        self._cache.commit()
     
-    def is_content_interesting(self, content: str) -> bool:
+    def _prefilter(self, content: str) -> Optional[bool]:
         """
-        Determine if the content is interesting based on AI evaluation.
+        Classify content that clearly matches one of the rules without calling the model.
         
         Args:
             content: The content to evaluate
             
         Returns:
-            bool: True if the content is interesting, False otherwise
-            
-        Raises:
-            ValueError: If the response can't be interpreted as True/False
+            The classification, or None if the content needs to be sent to the model
         """
-        if not content.strip():
-            logger.debug("Empty content, defaulting to True")
+        if self._reject_re.search(content):
+            logger.debug(f"Content rejected by pattern: {content[:50]}...")
+            return False
+        if self._accept_re.search(content):
+            logger.debug(f"Content accepted by pattern: {content[:50]}...")
             return True
+        if self._local_only_re.search(content):
+            logger.debug(f"Content rejected by pattern: {content[:50]}...")
+            return False
+        return None
+    
+    def _cache_key(self, content: str) -> str:
+        """Generate a cache key for content under the current model and prompt."""
+        return hashlib.sha256(f"{self.model}|{self.system_prompt}|{content}".encode()).hexdigest()
+    
+    async def _cache_get(self, content: str) -> Optional[bool]:
+        """
+        Look up a previous classification of the content.
+        
+        Args:
+            content: The content to look up
             
-        # API endpoint and headers
-        url = "https://openrouter.ai/api/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+        Returns:
+            The cached result or None if the content hasn't been classified before
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._cache_executor, self._cache_lookup, content)
+    
+    async def _cache_put(self, content: str, interesting: bool) -> None:
+        """Store the classification of the content."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._cache_executor, self._cache_store, content, interesting)
+    
+    def _cache_lookup(self, content: str) -> Optional[bool]:
+        """Blocking part of _cache_get, run on the cache thread."""
+        try:
+            row = self._cache.execute("SELECT value FROM ai_cache WHERE key = ?", (self._cache_key(content),)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error reading AI cache entry: {e}")
+            return None
+        if row is None:
+            AI_CACHE.labels(hit="false").inc()
+            return None
+        AI_CACHE.labels(hit="true").inc()
+        logger.debug(f"AI cache hit for content: {content[:50]}...")
+        return bool(row[0])
+    
+    def _cache_store(self, content: str, interesting: bool) -> None:
+        """Blocking part of _cache_put, run on the cache thread."""
+        try:
+            self._cache.execute(
+                "INSERT OR REPLACE INTO ai_cache (key, value) VALUES (?, ?)",
+                (self._cache_key(content), int(interesting))
+            )
+            self._cache.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error saving AI cache entry: {e}")
+    
+    def _ensure_client(self) -> httpx.AsyncClient:
+        """Create the shared HTTP client if it doesn't exist yet."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                },
+                timeout=30,
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60)
+            )
+        return self._client
+    
+    async def aclose(self) -> None:
+        """Close the HTTP client and the result cache."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._cache_executor, self._cache.close)
+        self._cache_executor.shutdown()
+    
+    async def _complete(self, system_prompt: str, user_message: str) -> str:
+        """
+        Send a prompt to OpenRouter and return the model's reply.
         
-        # Format the prompt with the content
-        user_message = self.prompt_template.format(content=content)
+        Args:
+            system_prompt: The system message with the filtering rules
+            user_message: The content to evaluate
         
+        Returns:
+            str: The stripped, lower-cased reply text
+        """
         # Request data
         data = {
             "model": self.model,
             "messages": [
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_message}
             ]
         }
         
+        for attempt in range(MAX_ATTEMPTS):
+            last_attempt = attempt == MAX_ATTEMPTS - 1
+            try:
+                async with self._limiter:
+                    with AI_LATENCY.time():
+                        response = await self._ensure_client().post(OPENROUTER_URL, json=data)
+            except httpx.TransportError as e:
+                if last_attempt:
+                    raise
+                delay = self._backoff_delay(attempt)
+                logger.warning(f"OpenRouter request failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            
+            if response.status_code == 429:
+                self._limiter.on_rate_limited()
+            elif response.is_success:
+                self._limiter.on_success()
+            
+            if response.status_code in RETRYABLE_STATUS_CODES and not last_attempt:
+                delay = self._retry_after(response) or self._backoff_delay(attempt)
+                logger.warning(f"OpenRouter returned {response.status_code}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            
+            response.raise_for_status()
+            break
+        
+        # Back off before the next call if we're about to run out of requests
+        await self._respect_rate_limit(response)
+        
+        # Process response
+        result = json_utils.loads(response.content)
+        response_text = result["choices"][0]["message"]["content"].strip().lower()
+        logger.info(f"Response from OpenRouter: {response_text}")
+        return response_text
+    
+    @staticmethod
+    def _backoff_delay(attempt: int) -> float:
+        """Exponential backoff with jitter for the given (zero-based) attempt."""
+        return min(MAX_RETRY_DELAY, (2 ** attempt) + random.random())
+    
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> float:
+        """
+        Get the delay requested by the server's Retry-After header.
+        
+        Args:
+            response: The rate-limited or failed response
+            
+        Returns:
+            float: Seconds to wait, or 0 if the header is missing or not a number
+        """
+        try:
+            return min(MAX_RETRY_DELAY, max(0.0, float(response.headers.get("Retry-After", 0))))
+        except ValueError:
+            return 0.0
+    
+    @staticmethod
+    async def _respect_rate_limit(response: httpx.Response) -> None:
+        """
+        Sleep until the rate limit window resets if almost no requests remain.
+        
+        Args:
+            response: A successful response carrying x-ratelimit-* headers
+        """
+        remaining = response.headers.get("x-ratelimit-remaining")
+        reset = response.headers.get("x-ratelimit-reset")
+        if remaining is None or reset is None:
+            return
+        
+        try:
+            remaining = int(float(remaining))
+            reset = float(reset)
+        except ValueError:
+            return
+        if remaining >= 2:
+            return
+        
+        # The reset header is either an epoch timestamp (s or ms) or a delay in seconds
+        if reset > 1e12:
+            delay = reset / 1000 - time.time()
+        elif reset > 1e9:
+            delay = reset - time.time()
+        else:
+            delay = reset
+        delay = min(MAX_RETRY_DELAY, delay)
+        if delay > 0:
+            logger.warning(f"OpenRouter rate limit nearly exhausted, waiting {delay:.1f}s")
+            await asyncio.sleep(delay)
+    
+    async def is_content_interesting(self, content: str) -> bool:
+        """
+        Determine if the content is interesting based on AI evaluation.
+        
+        Args:
+            content: The content to evaluate
+        
+        Returns:
+            bool: True if the content is interesting, False otherwise
+        
+        Raises:
+            ValueError: If the response can't be interpreted as True/False
+        """
+        if not content.strip():
+            logger.debug("Empty content, defaulting to True")
+            return True
+        
+        matched = self._prefilter(content)
+        if matched is not None:
+            return matched
+        
+        cached = await self._cache_get(content)
+        if cached is not None:
+            return cached
+        
+        return await self._classify_one(content)
+    
+    async def _classify_one(self, content: str) -> bool:
+        """
+        Ask the model about a single content that the prefilter and cache couldn't answer.
+        
+        Args:
+            content: The non-empty content to evaluate
+        
+        Returns:
+            bool: True if the content is interesting or the request failed, False otherwise
+        """
         try:
             # Make API request
             logger.debug(f"Sending request to OpenRouter for content: {content[:50]}...")
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            
-            # Process response
-            result = response.json()
-            response_text = result["choices"][0]["message"]["content"].strip().lower()
-            logger.info(f"Response from OpenRouter: {response_text}")
+            response_text = await self._complete(self.system_prompt, content)
             
             # Return boolean result
             if response_text == "true":
-                return True
+                interesting = True
             elif response_text == "false":
-                return False
+                interesting = False
             else:
                 # Attempt to extract true/false if model didn't follow instructions exactly
                 if "true" in response_text and "false" not in response_text:
                     logger.warning(f"Ambiguous response, interpreting as True: {response_text}")
-                    return True
+                    interesting = True
                 elif "false" in response_text and "true" not in response_text:
                     logger.warning(f"Ambiguous response, interpreting as False: {response_text}")
-                    return False
+                    interesting = False
                 else:
                     raise ValueError(f"Could not determine True/False from response: {response_text}")
-        except requests.RequestException as e:
+            
+            AI_RESULT.labels(result=str(interesting).lower()).inc()
+            await self._cache_put(content, interesting)
+            return interesting
+        except httpx.HTTPError as e:
             logger.error(f"API request error: {e}")
             # Default to True in case of API errors to avoid missing potentially important messages
             return True
@@ -113,3 +412,190 @@ class AIFilter:
             logger.error(f"Error in AI filtering: {e}")
             # Default to True in case of errors
             return True
+    
+    async def classify_many(self, contents: List[str]) -> List[bool]:
+        """
+        Determine which of several contents are interesting using batched prompts.
+        
+        Up to max_batch_size items are packed into each request. If a batched
+        reply can't be parsed or has the wrong length, the items of that batch
+        are evaluated one by one instead.
+        
+        Args:
+            contents: The contents to evaluate
+        
+        Returns:
+            List[bool]: One result per content, in the same order
+        """
+        results: List[bool] = []
+        for start in range(0, len(contents), self.max_batch_size):
+            results.extend(await self._classify_batch(contents[start:start + self.max_batch_size]))
+        return results
+    
+    async def _classify_batch(self, contents: List[str]) -> List[bool]:
+        """
+        Evaluate a single batch of at most max_batch_size contents.
+        
+        Args:
+            contents: The contents to evaluate
+        
+        Returns:
+            List[bool]: One result per content, in the same order
+        """
+        # Empty content defaults to True and pattern-matched or cached content is
+        # answered locally, so only send the rest to the model
+        results = [True] * len(contents)
+        pending = []
+        for i, content in enumerate(contents):
+            if not content.strip():
+                continue
+            known = self._prefilter(content)
+            if known is None:
+                known = await self._cache_get(content)
+            if known is None:
+                pending.append(i)
+            else:
+                results[i] = known
+        if not pending:
+            return results
+        if len(pending) == 1:
+            results[pending[0]] = await self._classify_one(contents[pending[0]])
+            return results
+        
+        items = "\n\n".join(f"Item {n}: {contents[i]}" for n, i in enumerate(pending))
+        try:
+            logger.debug(f"Sending batched request to OpenRouter for {len(pending)} items")
+            response_text = await self._complete(self.batch_system_prompt, items)
+        except httpx.HTTPError as e:
+            logger.error(f"API request error: {e}")
+            # Default to True in case of API errors to avoid missing potentially important messages
+            return results
+        except Exception as e:
+            logger.error(f"Error in AI filtering: {e}")
+            return results
+        
+        try:
+            # Models sometimes wrap JSON in a code fence
+            decoded = json_utils.loads(response_text.strip("`").removeprefix("json").strip())
+        except ValueError:
+            decoded = None
+        
+        if not isinstance(decoded, list) or len(decoded) != len(pending) or not all(isinstance(b, bool) for b in decoded):
+            logger.warning(f"Unusable batched response, falling back to per-item calls: {response_text}")
+            for i in pending:
+                results[i] = await self._classify_one(contents[i])
+            return results
+        
+        for i, interesting in zip(pending, decoded):
+            results[i] = interesting
+            AI_RESULT.labels(result=str(interesting).lower()).inc()
+            await self._cache_put(contents[i], interesting)
+        return results
+
+
+class BatchingAIFilter:
+    """
+    Coalesces concurrent AI filter requests into batched classify_many calls.
+    
+    Batches are classified concurrently, so a slow batch doesn't hold up the next
+    one; the wrapped AIFilter's limiter bounds how many requests are in flight.
+    """
+    
+    def __init__(self, inner: AIFilter, max_batch_size: int = 8, batch_window: float = 0.02):
+        """
+        Initialize the batching AI filter.
+        
+        Args:
+            inner: AIFilter instance that performs the actual classification
+            max_batch_size: Maximum number of contents classified in one call
+            batch_window: Seconds to wait for more requests after the first one arrives
+        """
+        self._inner = inner
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self._queue: asyncio.Queue[Tuple[str, asyncio.Future]] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        # Keep references to batches being classified so they aren't garbage collected
+        self._batch_tasks: Set[asyncio.Task] = set()
+    
+    def start(self) -> None:
+        """Start the background batching worker."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Stop the background batching worker."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._batch_tasks):
+            task.cancel()
+    
+    async def aclose(self) -> None:
+        """Stop the batching worker and close the wrapped AI filter."""
+        await self.stop()
+        await self._inner.aclose()
+    
+    async def submit(self, content: str) -> bool:
+        """
+        Queue content for classification and wait for its result.
+        
+        Args:
+            content: The content to evaluate
+            
+        Returns:
+            bool: True if the content is interesting, False otherwise
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((content, future))
+        return await future
+    
+    async def is_content_interesting(self, content: str) -> bool:
+        """Same as submit, so this can be used in place of an AIFilter."""
+        return await self.submit(content)
+    
+    async def classify_many(self, contents: List[str]) -> List[bool]:
+        """Submit several contents and wait for all of their results."""
+        return list(await asyncio.gather(*(self.submit(content) for content in contents)))
+    
+    async def _run(self) -> None:
+        """Collect queued requests into batches and classify them."""
+        loop = asyncio.get_running_loop()
+        while True:
+            # Block until there's work, then keep collecting for a short window
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            task = asyncio.create_task(self._classify_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+    
+    async def _classify_batch(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        """Classify a collected batch and resolve the futures of its requests."""
+        logger.debug(f"Classifying batch of {len(batch)} queued contents")
+        try:
+            results = await self._inner.classify_many([content for content, _ in batch])
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Error in batched AI filtering: {e}")
+            # Default to True in case of errors
+            results = [True] * len(batch)
+        
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -26,14 +26,28 @@ FORWARD_CHAT_ID: int = 0  # Replace with your forward destination ID
 
 # File paths for persistent storage
 SESSION_NAME: str = 'session_name'  # Name for the Telethon session file
+# Optional Telethon string session. When set, it's used instead of the session
+# file and the session is kept in memory. Generate one with:
+#   print(StringSession.save(client.session))
+SESSION_STRING: str = ''
 STATE_FILE: str = 'channel_states.json'  # File to store channel states
 MESSAGE_HASH_FILE: str = 'message_hashes.json'  # File to store message hashes
+AI_CACHE_FILE: str = 'ai_cache.sqlite'  # File to cache AI filter results
 
 # OpenRouter API configuration
 # Get this from https://openrouter.ai/keys
 OPENROUTER_API_KEY: str = "YOUR_OPENROUTER_API_KEY"
+OPENROUTER_MAX_CONCURRENT: int = 8  # Maximum number of concurrent OpenRouter requests
 
 # Message processing configuration
-MESSAGE_HASH_STORE_SIZE: int = 1000  # Size of the circular buffer for message hashes
+# Size of the circular buffer for message hashes. Messages whose hash is in the
+# buffer are skipped before the AI filter is called, so raise this for
+# high-volume source chats to catch more duplicates.
+MESSAGE_HASH_STORE_SIZE: int = 1000
 GROUP_PROCESSING_DELAY: int = 2  # Delay in seconds before processing grouped messages
-POLLING_INTERVAL: int = 10  # Interval in seconds between polling for new messages
+MAX_CONCURRENT_RPCS: int = 4  # Maximum number of concurrent Telegram requests
+FORWARD_RPS: float = 1.0  # Maximum number of forwards per second
+MESSAGE_WORKERS: int = 4  # Number of workers processing new messages concurrently
+
+# Monitoring configuration
+METRICS_PORT: int = 9108  # Port for the Prometheus metrics endpoint (requires prometheus_client)
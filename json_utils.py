@@ -0,0 +1,52 @@
+"""
+JSON helpers for the Telegram Auto Forwarder.
+Uses ssrjson or orjson when installed and falls back to the standard json module.
+"""
+import json
+from typing import Any, Union
+
+try:
+    import ssrjson
+except ImportError:
+    ssrjson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(obj: Any, indent: bool = False) -> bytes:
+    """
+    Serialize an object to UTF-8 encoded JSON.
+    
+    Args:
+        obj: The object to serialize
+        indent: Pretty-print with two-space indentation
+        
+    Returns:
+        bytes: The encoded JSON document
+    """
+    if ssrjson is not None:
+        return ssrjson.dumps_to_bytes(obj, indent=2) if indent else ssrjson.dumps_to_bytes(obj)
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode('utf-8')
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    Deserialize a JSON document.
+    
+    Args:
+        data: The JSON document as bytes or str
+        
+    Returns:
+        The decoded object
+    """
+    if ssrjson is not None:
+        return ssrjson.loads(data)
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -7,16 +7,9 @@ The information is saved to a text file for easy reference when configuring
 the Telegram Auto Forwarder.
 """
 import asyncio
-import json
-import os
-import sys
 from datetime import datetime
-from typing import Dict, List, Any, Optional
 
-from telethon import TelegramClient
-from telethon.tl.types import Channel, Chat, User, Dialog
-from telethon.tl.functions.messages import GetDialogsRequest
-from telethon.tl.functions.channels import GetFullChannelRequest
+import json_utils
 
 # Import config if available, otherwise use default values
 try:
@@ -36,8 +29,16 @@ except ImportError:
 OUTPUT_FILE = 'telegram_chats.txt'
 JSON_OUTPUT_FILE = 'telegram_chats.json'
 
+# Maximum number of concurrent GetFullChannelRequest calls
+FULL_CHANNEL_CONCURRENCY = 10
+
 async def fetch_chats():
     """Fetch all chats and channels the user has access to."""
+    # Telethon is imported here so a missing config prompt doesn't wait on it
+    from telethon import TelegramClient
+    from telethon.tl.types import Channel, Chat, User
+    from telethon.tl.functions.channels import GetFullChannelRequest
+    
     print(f"Connecting to Telegram with phone number {PHONE_NUMBER}...")
     client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
     await client.start(phone=PHONE_NUMBER)
@@ -48,6 +49,7 @@ async def fetch_chats():
     channels = []
     groups = []
     private_chats = []
+    channel_entities = []
     
     print("Processing dialogs...")
     for dialog in dialogs:
@@ -68,14 +70,8 @@ async def fetch_chats():
             if entity.broadcast:
                 chat_info['type'] = 'channel'
                 chat_info['participant_count'] = getattr(entity, 'participants_count', 'unknown')
-                # Get more details for channels
-                try:
-                    full_channel = await client(GetFullChannelRequest(channel=entity))
-                    chat_info['description'] = getattr(full_channel.full_chat, 'about', None)
-                    chat_info['member_count'] = getattr(full_channel.full_chat, 'participants_count', None)
-                except Exception as e:
-                    print(f"Couldn't get full info for channel {chat_info['name']}: {e}")
                 channels.append(chat_info)
+                channel_entities.append(entity)
             else:
                 chat_info['type'] = 'supergroup'
                 chat_info['participant_count'] = getattr(entity, 'participants_count', 'unknown')
@@ -88,6 +84,25 @@ async def fetch_chats():
             chat_info['type'] = 'private'
             private_chats.append(chat_info)
     
+    # Get more details for channels, a few requests at a time to avoid flood waits
+    print(f"Fetching details for {len(channel_entities)} channels...")
+    semaphore = asyncio.Semaphore(FULL_CHANNEL_CONCURRENCY)
+    
+    async def fetch_full_channel(entity):
+        async with semaphore:
+            return await client(GetFullChannelRequest(channel=entity))
+    
+    full_channels = await asyncio.gather(
+        *(fetch_full_channel(entity) for entity in channel_entities),
+        return_exceptions=True
+    )
+    for chat_info, full_channel in zip(channels, full_channels):
+        if isinstance(full_channel, Exception):
+            print(f"Couldn't get full info for channel {chat_info['name']}: {full_channel}")
+            continue
+        chat_info['description'] = getattr(full_channel.full_chat, 'about', None)
+        chat_info['member_count'] = getattr(full_channel.full_chat, 'participants_count', None)
+    
     await client.disconnect()
     return channels, groups, private_chats
 
@@ -173,8 +188,8 @@ def write_to_json_file(channels, groups, private_chats):
         "private_chats": private_chats
     }
     
-    with open(JSON_OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    with open(JSON_OUTPUT_FILE, 'wb') as f:
+        f.write(json_utils.dumps(data, indent=True))
     
     print(f"Chat information saved to {JSON_OUTPUT_FILE} (JSON format)")
 
@@ -2,20 +2,37 @@
 Logging configuration for the Telegram Auto Forwarder.
 """
 import logging
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from typing import Optional
 
 # Configure logger
 logger = logging.getLogger("telegram_forwarder")
 
-def setup_logger(log_level: str = "INFO", log_file: Optional[str] = None) -> None:
+# Background listener that writes queued log records to the real handlers
+_listener: Optional[QueueListener] = None
+
+def setup_logger(
+    log_level: str = "INFO",
+    log_file: Optional[str] = None,
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5
+) -> None:
     """
     Set up the logger with the specified log level and optional file output.
     
+    Records are handed to a background thread through a queue, so logging
+    never blocks the event loop on console or file I/O.
+    
     Args:
         log_level: The logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
         log_file: Optional file path to write logs to
+        max_bytes: Size at which the log file is rotated
+        backup_count: Number of rotated log files to keep
     """
+    global _listener
+    
     # Set the log level
     numeric_level = getattr(logging, log_level.upper(), None)
     if not isinstance(numeric_level, int):
@@ -30,12 +47,25 @@ def setup_logger(log_level: str = "INFO", log_file: Optional[str] = None) -> Non
     # Create console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    handlers = [console_handler]
     
     # Create file handler if log_file is specified
     if log_file:
-        file_handler = logging.FileHandler(log_file)
+        file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
+    
+    # Route records through a queue to the handlers on a background thread
+    log_queue: queue.Queue = queue.Queue(-1)
+    logger.addHandler(QueueHandler(log_queue))
+    _listener = QueueListener(log_queue, *handlers)
+    _listener.start()
     
     logger.info(f"Logger initialized with level {log_level}")
+
+def stop_logger() -> None:
+    """Flush queued log records and stop the background listener."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -4,30 +4,43 @@ Telegram Auto Forwarder - Main entry point.
 This script monitors specified Telegram channels and groups for new messages,
 filters them using AI, and forwards interesting messages to a target chat.
 """
+from __future__ import annotations
+
 import asyncio
 import signal
 import sys
-from typing import List, Union
-
-from telethon.tl.types import Channel, Chat, User
+from typing import TYPE_CHECKING, Optional, Union
 
-from logger import logger, setup_logger
+from logger import logger, setup_logger, stop_logger
 import config
-from state_manager import StateManager
-from ai_filter import AIFilter
-from telegram_client import TelegramForwarder
+
+# Telethon and the forwarder components are heavy to import, so they are
+# loaded inside run_forwarder() and only imported here for type checking
+if TYPE_CHECKING:
+    from telethon.tl.types import Channel, Chat, User
+    from state_manager import StateManager
+    from ai_filter import BatchingAIFilter
+    from telegram_client import TelegramForwarder
 
 async def run_forwarder():
     """Run the Telegram Auto Forwarder."""
     # Set up logging
     setup_logger(log_level="INFO")
     
+    from telethon import events
+    from metrics import start_metrics_server
+    from state_manager import StateManager
+    from ai_filter import AIFilter, BatchingAIFilter
+    from telegram_client import TelegramForwarder
+    
     try:
         # Initialize components
         logger.info("Initializing Telegram Auto Forwarder...")
         state_manager = StateManager()
-        ai_filter = AIFilter()
+        ai_filter = BatchingAIFilter(AIFilter())
+        ai_filter.start()
         forwarder = TelegramForwarder(state_manager, ai_filter)
+        start_metrics_server(getattr(config, 'METRICS_PORT', 9108))
         
         # Start the Telegram client
         await forwarder.start(phone=config.PHONE_NUMBER)
@@ -37,27 +50,21 @@ async def run_forwarder():
         for sig in (signal.SIGINT, signal.SIGTERM):
             loop.add_signal_handler(
                 sig,
-                lambda: asyncio.create_task(shutdown(forwarder, state_manager))
+                lambda: asyncio.create_task(shutdown(forwarder, state_manager, ai_filter))
             )
         
         # Initialize source chats
-        source_entities = []
-        for identifier in config.SOURCE_CHATS:
-            chat_entity = await forwarder.fetch_chat_entity(identifier)
-            if chat_entity:
-                await forwarder.initialize_chat(chat_entity)
-                source_entities.append(chat_entity)
-                chat_type = state_manager.determine_chat_type(chat_entity)
-                logger.info(f"Initialized {chat_type} {chat_entity.id} ({getattr(chat_entity, 'title', 'No Title')})")
-            else:
-                logger.error(f"Could not find chat: {identifier}")
+        initialized = await asyncio.gather(
+            *(initialize_source_chat(forwarder, state_manager, identifier) for identifier in config.SOURCE_CHATS)
+        )
+        source_entities = [chat_entity for chat_entity in initialized if chat_entity]
         
         if not source_entities:
             logger.error("No valid source chats found. Exiting.")
             return
             
         # Initialize forward chat (just make sure it exists)
-        forward_entity = await forwarder.fetch_chat_entity(config.FORWARD_CHAT_ID)
+        forward_entity = await forwarder.get_forward_entity()
         if not forward_entity:
             logger.error(f"Could not find forward chat with ID {config.FORWARD_CHAT_ID}. Exiting.")
             return
@@ -69,38 +76,73 @@ async def run_forwarder():
         chat_names = [getattr(entity, 'title', str(entity.id)) for entity in source_entities]
         logger.info(f"Monitoring new messages in: {', '.join(chat_names)}...")
         
-        # Main polling loop
-        while True:
-            for chat_entity in source_entities:
-                await forwarder.fetch_new_messages(chat_entity)
-            # Wait for a specified interval before polling again
-            await asyncio.sleep(config.POLLING_INTERVAL)
+        # Receive new messages as they arrive instead of polling. The handler is
+        # registered before the catch-up so nothing posted in between is missed;
+        # messages seen by both are skipped through the hash store
+        forwarder.client.add_event_handler(
+            forwarder.on_new_message,
+            events.NewMessage(chats=source_entities)
+        )
+        
+        # Catch up on messages missed while the forwarder wasn't running
+        await forwarder.fetch_all_new_messages(source_entities)
+        await forwarder.client.run_until_disconnected()
             
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt received")
-        await shutdown(forwarder, state_manager)
+        await shutdown(forwarder, state_manager, ai_filter)
     except Exception as e:
         logger.error(f"Unexpected error: {e}", exc_info=True)
-        await shutdown(forwarder, state_manager)
+        await shutdown(forwarder, state_manager, ai_filter)
+
+async def initialize_source_chat(
+    forwarder: TelegramForwarder,
+    state_manager: StateManager,
+    identifier: Union[str, int]
+) -> Optional[Union[Channel, Chat, User]]:
+    """
+    Resolve and initialize a single source chat.
+    
+    Args:
+        forwarder: TelegramForwarder instance
+        state_manager: StateManager instance
+        identifier: Chat username, ID or invite link from config
+        
+    Returns:
+        The chat entity, or None if it could not be found
+    """
+    chat_entity = await forwarder.fetch_chat_entity(identifier)
+    if not chat_entity:
+        logger.error(f"Could not find chat: {identifier}")
+        return None
+    
+    await forwarder.initialize_chat(chat_entity)
+    chat_type = state_manager.determine_chat_type(chat_entity)
+    logger.info(f"Initialized {chat_type} {chat_entity.id} ({getattr(chat_entity, 'title', 'No Title')})")
+    return chat_entity
 
-async def shutdown(forwarder: TelegramForwarder, state_manager: StateManager):
+async def shutdown(forwarder: TelegramForwarder, state_manager: StateManager, ai_filter: BatchingAIFilter):
     """
     Perform graceful shutdown.
     
     Args:
         forwarder: TelegramForwarder instance
         state_manager: StateManager instance
+        ai_filter: BatchingAIFilter instance
     """
     logger.info("Shutting down...")
     try:
-        # Save states one more time on clean exit
-        state_manager.save_chat_states()
-        state_manager.save_message_hash_store()
+        # Let the forwarder finish the queued messages and media groups first,
+        # then save states one more time on clean exit
         await forwarder.stop()
+        await state_manager.save_chat_states_async()
+        await state_manager.save_message_hash_store_async()
+        await ai_filter.aclose()
         logger.info("Bot stopped. Chat states and message hashes saved.")
     except Exception as e:
         logger.error(f"Error during shutdown: {e}")
     finally:
+        stop_logger()
         # Force exit if still running
         sys.exit(0)
 
@@ -0,0 +1,57 @@
+"""
+Prometheus metrics for the Telegram Auto Forwarder.
+Metrics are no-ops if prometheus_client is not installed.
+"""
+from contextlib import nullcontext
+
+from logger import logger
+
+try:
+    from prometheus_client import Counter, Histogram, start_http_server
+except ImportError:
+    Counter = Histogram = start_http_server = None
+
+class _NoopMetric:
+    """Stand-in for Prometheus metrics when prometheus_client is missing."""
+    
+    def labels(self, *args, **kwargs) -> "_NoopMetric":
+        return self
+    
+    def inc(self, amount: float = 1) -> None:
+        pass
+    
+    def observe(self, amount: float) -> None:
+        pass
+    
+    def time(self) -> nullcontext:
+        return nullcontext()
+
+if Counter is not None:
+    AI_LATENCY = Histogram(
+        "ai_filter_seconds",
+        "OpenRouter request latency",
+        buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10)
+    )
+    AI_RESULT = Counter("ai_filter_result", "AI filter decisions", ["result"])
+    AI_CACHE = Counter("ai_filter_cache", "AI filter cache lookups", ["hit"])
+    MESSAGES_PROCESSED = Counter("forwarder_messages", "Processed messages by outcome", ["outcome"])
+else:
+    AI_LATENCY = AI_RESULT = AI_CACHE = MESSAGES_PROCESSED = _NoopMetric()
+
+def start_metrics_server(port: int) -> None:
+    """
+    Expose the metrics over HTTP for Prometheus to scrape.
+    
+    Args:
+        port: Port to listen on
+    """
+    if start_http_server is None:
+        logger.info("prometheus_client not installed, metrics are disabled")
+        return
+    try:
+        start_http_server(port)
+    except OSError as e:
+        # Metrics are optional, so a busy port shouldn't stop the forwarder
+        logger.error(f"Could not start metrics server on port {port}: {e}")
+        return
+    logger.info(f"Serving Prometheus metrics on port {port}")
@@ -2,15 +2,102 @@
 State management for the Telegram Auto Forwarder.
 Handles chat states (for both channels and groups) and message hashes.
 """
-import json
 import os
+import sys
+import time
+import asyncio
+import atexit
+import struct
 import hashlib
-from typing import Dict, Any, List, Optional, Union
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Any, Iterable, List, Optional, Set, Union
 from telethon.tl.patched import Message
 from telethon.tl.types import Channel, Chat, User
 
+# The hash function depends on the installed packages, so its name is saved with
+# the hash store and hashes from a different one are discarded on load
+try:
+    from xxhash import xxh3_64_intdigest as _hash64
+    _HASH_ALGORITHM = 'xxh3_64'
+except ImportError:
+    # Without xxhash, use the SIMD-accelerated BLAKE3 if it's installed and BLAKE2b otherwise
+    try:
+        from blake3 import blake3 as _new_digest
+        _HASH_ALGORITHM = 'blake3_64'
+    except ImportError:
+        def _new_digest(data: bytes):
+            return hashlib.blake2b(data, digest_size=8)
+        _HASH_ALGORITHM = 'blake2b_64'
+
+    def _hash64(data: bytes) -> int:
+        """First 64 bits of a BLAKE3/BLAKE2b digest as an int, used when xxhash isn't installed."""
+        return int.from_bytes(_new_digest(data).digest()[:8], 'little')
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 from logger import logger
 import config
+import json_utils
+
+# Hash of messages without text. Caption-less media all share it, so it says nothing
+# about whether a message was seen before and is never stored or matched
+_EMPTY_HASH = _hash64(b"")
+
+# Chat type for each Telegram entity class, apart from Channel which depends on its broadcast flag
+_CHAT_TYPES: Dict[type, str] = {Chat: 'group', User: 'private'}
+
+# Message hashes added since the last snapshot are appended to this journal as
+# fixed-size records instead of rewriting the whole hash store file each time
+_HASH_RECORD = struct.Struct("<Q")
+
+def _encode_state(obj: Any) -> bytes:
+    """Encode state for saving, as msgpack when it's installed and JSON otherwise."""
+    if msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True)
+    return json_utils.dumps(obj)
+
+def _encode_state_entry(key: str, value: Any) -> bytes:
+    """Encode a single key/value pair of a state mapping, to be combined by _join_state_entries."""
+    if msgpack is not None:
+        return msgpack.packb(key) + msgpack.packb(value, use_bin_type=True)
+    return json_utils.dumps(key) + b':' + json_utils.dumps(value)
+
+def _join_state_entries(entries: List[bytes]) -> bytes:
+    """Combine entries from _encode_state_entry into one encoded mapping that _decode_state can read."""
+    if msgpack is not None:
+        return msgpack.Packer().pack_map_header(len(entries)) + b''.join(entries)
+    return b'{' + b','.join(entries) + b'}'
+
+def _decode_state(data: bytes) -> Any:
+    """Decode a saved state file, accepting both JSON and msgpack contents."""
+    # JSON state files always start with an object or array
+    if data.lstrip()[:1] in (b'{', b'['):
+        return json_utils.loads(data)
+    if msgpack is None:
+        raise ValueError("State file is in msgpack format but msgpack is not installed")
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+def _atomic_write(path: str, data: bytes) -> None:
+    """
+    Write a file so it's either fully replaced or left untouched.
+    
+    The data is written and fsynced to a temporary file which then replaces
+    the target, so a crash mid-write can't leave a truncated state file.
+    
+    Args:
+        path: File to write
+        data: Contents of the file
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
 
 class StateManager:
     """Manages persistent state for the Telegram Auto Forwarder."""
@@ -18,10 +105,26 @@ class StateManager:
     def __init__(self):
         """Initialize the state manager."""
         self.chat_states: Dict[int, Dict[str, Any]] = {}
-        self.message_hash_store: Dict[str, Any] = {
-            "hashes": [""] * config.MESSAGE_HASH_STORE_SIZE,
-            "pointer": 0
-        }
+        # Most recently seen message hashes, least recent first (LRU order)
+        self.message_hash_store: "OrderedDict[int, None]" = OrderedDict()
+        self._hash_journal_path = config.MESSAGE_HASH_FILE + ".journal"
+        self._hash_journal: Optional[BinaryIO] = None
+        self._hash_journal_records = 0
+        # Hashes added since the last journal write, appended together by the next flush
+        self._pending_hashes: List[int] = []
+        self._last_hash_flush = time.monotonic()
+        
+        # Chat state updates are batched and written at most every few seconds
+        self._chat_states_dirty = False
+        self._last_chat_states_save = time.monotonic()
+        # Encoded state of each chat, kept between saves and dropped when the chat changes
+        self._serialized_chat_states: Dict[int, bytes] = {}
+        atexit.register(self.flush_chat_states)
+        atexit.register(self.flush_message_hashes)
+        
+        # Async saves run on a single worker thread so file writes stay in order
+        # and never block the event loop
+        self._io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state_io")
         
         # Load existing states
         self.load_chat_states()
@@ -34,76 +137,288 @@ class StateManager:
             return
         
         try:
-            with open(config.STATE_FILE, 'r') as f:
-                # Convert chat IDs from str back to int
-                serialized_states = json.load(f)
-                self.chat_states = {int(chat_id): data for chat_id, data in serialized_states.items()}
+            with open(config.STATE_FILE, 'rb') as f:
+                # Convert chat IDs from str back to int and intern the state keys,
+                # so lookups with the 'pts'/'type' literals hit the identity fast path
+                serialized_states = _decode_state(f.read())
+                self._serialized_chat_states.clear()
+                self.chat_states = {
+                    int(chat_id): {sys.intern(key): value for key, value in data.items()}
+                    for chat_id, data in serialized_states.items()
+                }
                 logger.info(f"Loaded chat states from {config.STATE_FILE}")
         except Exception as e:
             logger.error(f"Error loading chat states: {e}")
     
     def save_chat_states(self) -> None:
         """Save chat states to a file."""
-        # Convert chat IDs from int to str for JSON serialization
-        serializable_states = {str(chat_id): data for chat_id, data in self.chat_states.items()}
+        self._write_chat_states(self._snapshot_chat_states())
+    
+    async def save_chat_states_async(self) -> None:
+        """Save chat states to a file without blocking the event loop."""
+        snapshot = self._snapshot_chat_states()
+        await asyncio.get_running_loop().run_in_executor(self._io_executor, self._write_chat_states, snapshot)
+    
+    def _snapshot_chat_states(self) -> List[bytes]:
+        """Encode the chat states for saving and mark them as saved."""
+        self._chat_states_dirty = False
+        self._last_chat_states_save = time.monotonic()
+        # Only chats that changed since the last save need to be encoded again.
+        # Chat IDs are converted from int to str for serialization
+        serialized = self._serialized_chat_states
+        for chat_id, data in self.chat_states.items():
+            if chat_id not in serialized:
+                serialized[chat_id] = _encode_state_entry(str(chat_id), data)
+        return list(serialized.values())
+    
+    def _write_chat_states(self, entries: List[bytes]) -> None:
+        """Write a chat states snapshot to the state file."""
         try:
-            with open(config.STATE_FILE, 'w') as f:
-                json.dump(serializable_states, f)
+            _atomic_write(config.STATE_FILE, _join_state_entries(entries))
             logger.info(f"Chat states saved to {config.STATE_FILE}")
         except Exception as e:
             logger.error(f"Error saving chat states: {e}")
     
+    def _should_flush(self, min_interval: float) -> bool:
+        """Check if chat states changed and the last save is old enough."""
+        return self._chat_states_dirty and time.monotonic() - self._last_chat_states_save >= min_interval
+    
+    def _should_flush_hashes(self, min_interval: float) -> bool:
+        """Check if hashes are waiting for the journal and the last journal write is old enough."""
+        return bool(self._pending_hashes) and time.monotonic() - self._last_hash_flush >= min_interval
+    
+    async def maybe_flush_async(self, min_interval: float = 5.0) -> None:
+        """
+        Save chat states and pending message hashes without blocking the event loop
+        if they changed and the last save is old enough.
+        
+        Args:
+            min_interval: Minimum number of seconds between saves
+        """
+        if self._should_flush(min_interval):
+            await self.save_chat_states_async()
+        if self._should_flush_hashes(min_interval):
+            hashes = self._take_pending_hashes()
+            await asyncio.get_running_loop().run_in_executor(self._io_executor, self._append_to_journal, hashes)
+    
+    def flush_chat_states(self) -> None:
+        """Save chat states if they have unsaved changes."""
+        if self._chat_states_dirty:
+            self.save_chat_states()
+    
     def load_message_hash_store(self) -> None:
-        """Load message hash store from file or initialize if not exists."""
+        """Load message hash store from file and journal, then compact them into a new snapshot."""
+        replay_journal = True
         if os.path.exists(config.MESSAGE_HASH_FILE):
             try:
-                with open(config.MESSAGE_HASH_FILE, 'r') as f:
-                    self.message_hash_store = json.load(f)
+                with open(config.MESSAGE_HASH_FILE, 'rb') as f:
+                    snapshot = _decode_state(f.read())
+                if isinstance(snapshot, dict) and 'algorithm' in snapshot:
+                    algorithm, hashes = snapshot['algorithm'], snapshot['hashes']
+                elif isinstance(snapshot, list):
+                    # Snapshots written before the algorithm was saved with them
+                    algorithm, hashes = _HASH_ALGORITHM, snapshot
+                else:
+                    algorithm, hashes = None, None
+                
+                if hashes is None:
+                    # Hashes from the old circular buffer format can't match the new hash function
+                    logger.info(f"Ignoring message hash store in old format at {config.MESSAGE_HASH_FILE}")
+                elif algorithm != _HASH_ALGORITHM:
+                    # The journal was written with the same hash function as the snapshot
+                    replay_journal = False
+                    logger.warning(
+                        f"Message hash store at {config.MESSAGE_HASH_FILE} was written with {algorithm}, "
+                        f"but {_HASH_ALGORITHM} is in use. Starting with an empty store."
+                    )
+                else:
+                    for message_hash in hashes:
+                        self._remember_hash(message_hash)
                     logger.info(f"Loaded message hash store from {config.MESSAGE_HASH_FILE}")
             except Exception as e:
                 logger.error(f"Error loading message hash store: {e}")
                 # Initialize with default values if loading fails
-                self.message_hash_store = {
-                    "hashes": [""] * config.MESSAGE_HASH_STORE_SIZE,
-                    "pointer": 0
-                }
-        else:
-            # Initialize with default values if file doesn't exist
-            self.message_hash_store = {
-                "hashes": [""] * config.MESSAGE_HASH_STORE_SIZE,
-                "pointer": 0
-            }
-            self.save_message_hash_store()
+                self.message_hash_store = OrderedDict()
+        
+        # Replay hashes added after the snapshot was written
+        if replay_journal and os.path.exists(self._hash_journal_path):
+            try:
+                with open(self._hash_journal_path, 'rb') as f:
+                    journal = f.read()
+                # Ignore a partially written last record
+                usable = len(journal) - len(journal) % _HASH_RECORD.size
+                for (message_hash,) in _HASH_RECORD.iter_unpack(journal[:usable]):
+                    self._remember_hash(message_hash)
+                logger.info(f"Replayed {usable // _HASH_RECORD.size} hashes from {self._hash_journal_path}")
+            except Exception as e:
+                logger.error(f"Error replaying message hash journal: {e}")
+        
+        # Stores written before empty content was excluded can still hold its hash
+        self.message_hash_store.pop(_EMPTY_HASH, None)
+        self.save_message_hash_store()
     
     def save_message_hash_store(self) -> None:
-        """Save message hash store to file."""
+        """Save a snapshot of the message hash store to file and start a new journal."""
+        self._write_hash_snapshot(self._full_hash_snapshot())
+    
+    async def save_message_hash_store_async(self) -> None:
+        """Save a snapshot of the message hash store without blocking the event loop."""
+        snapshot = self._full_hash_snapshot()
+        await asyncio.get_running_loop().run_in_executor(self._io_executor, self._write_hash_snapshot, snapshot)
+    
+    def _write_hash_snapshot(self, hashes: List[int]) -> None:
+        """Write a hash store snapshot to file and truncate the journal."""
         try:
-            with open(config.MESSAGE_HASH_FILE, 'w') as f:
-                json.dump(self.message_hash_store, f)
+            _atomic_write(config.MESSAGE_HASH_FILE, _encode_state({'algorithm': _HASH_ALGORITHM, 'hashes': hashes}))
+            
+            # Everything in the journal is now part of the snapshot
+            if self._hash_journal is not None:
+                self._hash_journal.close()
+            self._hash_journal = open(self._hash_journal_path, 'wb')
             logger.info(f"Message hash store saved to {config.MESSAGE_HASH_FILE}")
         except Exception as e:
             logger.error(f"Error saving message hash store: {e}")
     
-    def is_hash_in_store(self, message_hash: str) -> bool:
+    def is_hash_in_store(self, message_hash: int) -> bool:
         """Check if a message hash exists in the store."""
-        return message_hash in self.message_hash_store["hashes"]
-    
-    def add_hash_to_store(self, message_hash: str) -> None:
-        """Add a new hash to the store and update the pointer."""
-        pointer = self.message_hash_store["pointer"]
-        self.message_hash_store["hashes"][pointer] = message_hash
-        # Update pointer (circular buffer)
-        self.message_hash_store["pointer"] = (pointer + 1) % config.MESSAGE_HASH_STORE_SIZE
-        self.save_message_hash_store()
+        return message_hash != _EMPTY_HASH and message_hash in self.message_hash_store
+    
+    def are_hashes_in_store(self, message_hashes: Iterable[int]) -> Set[int]:
+        """Return the message hashes that exist in the store, checked in one lookup."""
+        present = self.message_hash_store.keys() & set(message_hashes)
+        present.discard(_EMPTY_HASH)
+        return present
+    
+    async def add_hashes_to_store_async(self, message_hashes: Iterable[int]) -> List[int]:
+        """
+        Add hashes to the store. They are appended to the journal by the next flush,
+        and a due compaction is written without blocking the event loop.
+        
+        The membership check and insert happen immediately, so concurrent callers
+        see the hashes before they have been written.
+        
+        Args:
+            message_hashes: Hashes to add
+            
+        Returns:
+            The hashes that weren't in the store yet
+        """
+        new_hashes = [h for h in message_hashes if h != _EMPTY_HASH and self._remember_hash(h)]
+        if new_hashes:
+            snapshot = self._queue_hashes(new_hashes)
+            if snapshot is not None:
+                await asyncio.get_running_loop().run_in_executor(self._io_executor, self._write_hash_snapshot, snapshot)
+        return new_hashes
+    
+    async def check_and_add_async(self, message_hash: int) -> bool:
+        """
+        Check whether a hash is in the store and add it if it isn't, in one step.
+        
+        Args:
+            message_hash: Hash to check and add
+            
+        Returns:
+            bool: True if the hash was already in the store (never for empty content)
+        """
+        if message_hash == _EMPTY_HASH:
+            return False
+        return not await self.add_hashes_to_store_async([message_hash])
+    
+    def discard_hash(self, message_hash: int) -> None:
+        """
+        Remove a hash from the store, e.g. when the message it was claimed for wasn't forwarded.
+        
+        A hash already written to the journal is left there; the next compaction
+        writes a snapshot without it.
+        
+        Args:
+            message_hash: Hash to remove
+        """
+        if message_hash not in self.message_hash_store:
+            return
+        del self.message_hash_store[message_hash]
+        if message_hash in self._pending_hashes:
+            self._pending_hashes.remove(message_hash)
     
-    def generate_message_hash(self, message: Message) -> str:
-        """Generate a hash for a message using only message.message content."""
-        content = message.message if message.message else ""
-        return hashlib.sha256(content.encode()).hexdigest()
+    def flush_message_hashes(self) -> None:
+        """Append hashes added since the last journal write to the journal."""
+        if self._pending_hashes:
+            self._append_to_journal(self._take_pending_hashes())
+    
+    def _queue_hashes(self, new_hashes: List[int]) -> Optional[List[int]]:
+        """
+        Queue newly added hashes for the journal and decide whether to compact instead.
+        
+        Args:
+            new_hashes: Hashes just added to the store
+            
+        Returns:
+            A snapshot of the store to write in place of the journal once the journal
+            holds a full store's worth of hashes, otherwise None
+        """
+        self._pending_hashes.extend(new_hashes)
+        self._hash_journal_records += len(new_hashes)
+        if self._hash_journal is None or self._hash_journal_records >= config.MESSAGE_HASH_STORE_SIZE:
+            return self._full_hash_snapshot()
+        return None
+    
+    def _full_hash_snapshot(self) -> List[int]:
+        """Copy the whole store for a snapshot, which also covers every pending hash."""
+        self._hash_journal_records = 0
+        self._pending_hashes = []
+        self._last_hash_flush = time.monotonic()
+        return list(self.message_hash_store)
+    
+    def _take_pending_hashes(self) -> List[int]:
+        """Take the hashes waiting for the journal and mark the journal as written."""
+        hashes, self._pending_hashes = self._pending_hashes, []
+        self._last_hash_flush = time.monotonic()
+        return hashes
+    
+    def _append_to_journal(self, message_hashes: List[int]) -> None:
+        """Append hashes to the journal in a single write."""
+        try:
+            self._hash_journal.write(b''.join(_HASH_RECORD.pack(h) for h in message_hashes))
+            self._hash_journal.flush()
+        except Exception as e:
+            logger.error(f"Error writing message hash journal: {e}")
+    
+    def _remember_hash(self, message_hash: int) -> bool:
+        """
+        Add a hash to the in-memory store, evicting the least recently seen one if it's full.
+        
+        Args:
+            message_hash: Hash to add
+            
+        Returns:
+            bool: False if the hash was already in the store (it's marked as recently seen)
+        """
+        if message_hash in self.message_hash_store:
+            self.message_hash_store.move_to_end(message_hash)
+            return False
+        self.message_hash_store[message_hash] = None
+        if len(self.message_hash_store) > config.MESSAGE_HASH_STORE_SIZE:
+            self.message_hash_store.popitem(last=False)
+        return True
+    
+    def generate_message_hash(self, message: Message) -> int:
+        """
+        Generate a hash for a message using only message.message content.
+        
+        The hash only serves for deduplication, so a fast non-cryptographic
+        64-bit hash (XXH3 when xxhash is installed, then BLAKE3, then BLAKE2b) is used.
+        """
+        content = message.message
+        if not content:
+            # Media without a caption is common, so skip encoding for empty content
+            return _EMPTY_HASH
+        return _hash64(content.encode('utf-8'))
     
     def update_chat_state(self, chat_id: int, state_data: Dict[str, Any]) -> None:
         """
-        Update the state data for a chat and save the state.
+        Update the state data for a chat.
+        
+        The change is saved by the next maybe_flush_async() or flush_chat_states() call.
         
         Args:
             chat_id: ID of the chat
@@ -114,7 +429,8 @@ class StateManager:
         
         # Update with new state data
         self.chat_states[chat_id].update(state_data)
-        self.save_chat_states()
+        self._serialized_chat_states.pop(chat_id, None)
+        self._chat_states_dirty = True
     
     def get_chat_state(self, chat_id: int, key: str) -> Optional[Any]:
         """
@@ -141,6 +457,7 @@ class StateManager:
             state_data: Initial state data
         """
         self.chat_states[chat_id] = {'type': chat_type, **state_data}
+        self._serialized_chat_states.pop(chat_id, None)
         self.save_chat_states()
         logger.info(f"Initialized {chat_type} {chat_id} with state data: {state_data}")
     
@@ -168,14 +485,10 @@ class StateManager:
         Returns:
             Chat type as string ('channel', 'group', or 'private')
         """
-        if isinstance(entity, Channel):
+        entity_type = type(entity)
+        if entity_type is Channel:
             if entity.broadcast:
                 return 'channel'
             else:
                 return 'group'  # Supergroup
-        elif isinstance(entity, Chat):
-            return 'group'
-        elif isinstance(entity, User):
-            return 'private'
-        else:
-            return 'unknown'
+        return _CHAT_TYPES.get(entity_type, 'unknown')
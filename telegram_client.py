@@ -3,42 +3,150 @@ Telegram client functionality for the Telegram Auto Forwarder.
 Supports both channels and groups.
 """
 import asyncio
-from typing import Dict, List, Optional, Tuple, Set, Union, Any
-from telethon import TelegramClient, functions, types
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple, Union, Any, Awaitable, Callable
+from telethon import TelegramClient, events, functions, types, utils
+from telethon.sessions import StringSession
 from telethon.tl.patched import Message
-from telethon.tl.types import Channel, Chat, User, InputChannel, InputPeerChannel, InputPeerChat, InputPeerUser
+from telethon.tl.types import Channel, Chat, User
 from telethon.errors import FloodWaitError
 
 from logger import logger
 import config
+from metrics import MESSAGES_PROCESSED
 from state_manager import StateManager
-from ai_filter import AIFilter
+from ai_filter import AIFilter, BatchingAIFilter
+
+# Maximum number of media groups collected at once
+MAX_PENDING_GROUPS = 1000
+
+# Maximum number of new messages waiting for a worker
+MAX_QUEUED_MESSAGES = 1000
+
+# Maximum number of media groups being filtered and forwarded at once
+MAX_CONCURRENT_GROUPS = 4
+
+# Maximum number of chat entities kept in the lookup cache
+MAX_CACHED_ENTITIES = 1000
+
+# Seconds between background saves of changed chat states and message hashes
+STATE_FLUSH_INTERVAL = 5.0
+
+# Seconds stop() waits for queued messages and pending media groups to be handled
+DRAIN_TIMEOUT = 30.0
+
+# Retry policy for requests that hit a flood wait
+MAX_RPC_ATTEMPTS = 3
+MAX_FLOOD_WAIT = 300
+
+class _RateLimiter:
+    """Spaces out requests so they start at most a given number of times per second."""
+    
+    def __init__(self, rate: float):
+        """
+        Initialize the rate limiter.
+        
+        Args:
+            rate: Maximum number of requests per second
+            
+        Raises:
+            ValueError: If rate isn't positive
+        """
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        self._interval = 1.0 / rate
+        self._last = 0.0
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self) -> None:
+        """Wait until the next request is allowed to start."""
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._interval - (loop.time() - self._last)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._last = loop.time()
 
 class TelegramForwarder:
     """Handles Telegram client operations for message forwarding."""
     
-    def __init__(self, state_manager: StateManager, ai_filter: AIFilter):
+    def __init__(self, state_manager: StateManager, ai_filter: Union[AIFilter, BatchingAIFilter]):
         """
         Initialize the Telegram forwarder.
         
         Args:
             state_manager: StateManager instance for handling state
-            ai_filter: AIFilter instance for filtering messages
+            ai_filter: AIFilter or BatchingAIFilter instance for filtering messages
         """
+        # A string session keeps the whole session in memory, so nothing is written
+        # to the SQLite session file while messages are processed
+        session_string = getattr(config, 'SESSION_STRING', '')
+        session = StringSession(session_string) if session_string else config.SESSION_NAME
         self.client = TelegramClient(
-            config.SESSION_NAME,
+            session,
             config.API_ID,
-            config.API_HASH
+            config.API_HASH,
+            # Reconnect on dropped connections instead of failing the whole session
+            connection_retries=5,
+            retry_delay=1,
+            auto_reconnect=True,
+            request_retries=3,
+            # Raise every flood wait instead of letting Telethon sleep through it inside
+            # the request, which would hold an _rpc_sem slot; _retry_rpc waits outside it
+            flood_sleep_threshold=0,
+            # Handlers only queue messages for the workers, so running them one at a
+            # time lets a full queue hold back further updates
+            sequential_updates=True
         )
         self.state_manager = state_manager
         self.ai_filter = ai_filter
         
+        # New messages pushed by Telegram, processed by a fixed pool of workers
+        self._message_queue: "asyncio.Queue[Tuple[Union[Channel, Chat, User], Message, Optional[int]]]" = asyncio.Queue(MAX_QUEUED_MESSAGES)
+        self._message_workers: List[asyncio.Task] = []
+        # Positions (pts or message ID) of new messages per chat in arrival order, and
+        # whether each has been handled. A chat's saved position only moves up to the
+        # last message before the first one still pending
+        self._positions: Dict[int, "OrderedDict[int, bool]"] = {}
+        # Positions of album messages, handled once their whole group has been processed
+        self._group_positions: Dict[int, List[Tuple[int, int]]] = {}
+        
         # Dictionary to store grouped messages until all are received
-        self.grouped_messages: Dict[int, List[Tuple[Message, str]]] = {}
-        self.processing_groups: Set[int] = set()
+        self.grouped_messages: Dict[int, List[Tuple[Message, int]]] = {}
+        # Pending groups with the time they're due and their source chat. Every group
+        # waits the same delay, so insertion order is also deadline order
+        self._group_deadlines: Dict[int, Tuple[float, Union[Channel, Chat, User]]] = {}
+        self._group_wake = asyncio.Event()
+        self._group_coalescer: Optional[asyncio.Task] = None
+        # Due groups are processed in their own tasks so one slow group doesn't hold up the rest
+        self._group_tasks: Set[asyncio.Task] = set()
+        self._group_slots = asyncio.Semaphore(MAX_CONCURRENT_GROUPS)
+        
+        # Saves state changes even when no new message comes in to trigger a save
+        self._state_flusher: Optional[asyncio.Task] = None
+        
+        # Bound concurrent Telegram requests so bursts of messages don't trigger flood waits
+        self._rpc_sem = asyncio.Semaphore(getattr(config, 'MAX_CONCURRENT_RPCS', 4))
+        # Space out forwards to stay under Telegram's per-chat sending limits
+        self._forward_limiter = _RateLimiter(getattr(config, 'FORWARD_RPS', 1.0))
         
-        # Store chat entities to avoid repeated lookups
-        self.chat_entities: Dict[int, Any] = {}
+        # Store chat entities to avoid repeated lookups, least recently used first
+        self.chat_entities: "OrderedDict[Union[str, int], Any]" = OrderedDict()
+        
+        # Saved chat type of each source chat, and the catch-up fetcher for each type
+        self._chat_types: Dict[int, str] = {}
+        self._fetchers: Dict[str, Callable[[Any], Awaitable[None]]] = {
+            'channel': self._fetch_channel_difference,
+            'group': self._fetch_group_messages,
+        }
+        
+        # Input peers/channels of the chats we read from and forward to, built once per chat
+        self._input_peers: Dict[int, Any] = {}
+        self._input_channels: Dict[int, types.InputChannel] = {}
+        
+        # Forward destination, resolved when the client starts
+        self._forward_entity: Optional[Union[Channel, Chat, User]] = None
     
     async def start(self, phone: str) -> None:
         """
@@ -49,12 +157,46 @@ class TelegramForwarder:
         """
         await self.client.start(phone=phone)
         logger.info("Telegram client started successfully")
+        await self.get_forward_entity()
+        self._group_coalescer = asyncio.create_task(self._group_coalescer_loop())
+        self._message_workers = [
+            asyncio.create_task(self._message_worker()) for _ in range(getattr(config, 'MESSAGE_WORKERS', 4))
+        ]
+        self._state_flusher = asyncio.create_task(self._state_flush_loop())
     
     async def stop(self) -> None:
-        """Stop the Telegram client."""
+        """Stop the Telegram client once the queued messages and pending media groups are handled."""
+        self.client.remove_event_handler(self.on_new_message)
+        try:
+            await asyncio.wait_for(self._drain(), DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Unhandled messages keep the saved positions behind them, so they're fetched on the next start
+            logger.warning(f"Pending messages weren't handled within {DRAIN_TIMEOUT} seconds. Stopping anyway.")
+        
+        for worker in self._message_workers:
+            worker.cancel()
+        if self._group_coalescer is not None:
+            self._group_coalescer.cancel()
+        for task in list(self._group_tasks):
+            task.cancel()
+        if self._state_flusher is not None:
+            self._state_flusher.cancel()
         await self.client.disconnect()
         logger.info("Telegram client stopped")
     
+    async def _drain(self) -> None:
+        """Wait for the queued messages, then process the remaining media groups without their delay."""
+        await self._message_queue.join()
+        if self._group_coalescer is not None:
+            self._group_coalescer.cancel()
+        
+        for group_id, (_, chat_entity) in list(self._group_deadlines.items()):
+            del self._group_deadlines[group_id]
+            await self._group_slots.acquire()
+            self._start_group(chat_entity, group_id)
+        if self._group_tasks:
+            await asyncio.gather(*self._group_tasks, return_exceptions=True)
+    
     async def fetch_chat_entity(self, identifier: Union[str, int]) -> Optional[Union[Channel, Chat, User]]:
         """
         Fetch a chat entity by username or ID.
@@ -65,15 +207,84 @@ class TelegramForwarder:
         Returns:
             Chat entity or None if not found
         """
+        entity = self.chat_entities.get(identifier)
+        if entity is not None:
+            self.chat_entities.move_to_end(identifier)
+            return entity
+        
         try:
-            entity = await self.client.get_entity(identifier)
-            # Cache the entity
-            self.chat_entities[entity.id] = entity
+            entity = await self._call_rpc(lambda: self.client.get_entity(identifier))
+            # Cache the entity, dropping the least recently used one when full
+            self.chat_entities[identifier] = entity
+            if len(self.chat_entities) > MAX_CACHED_ENTITIES:
+                self.chat_entities.popitem(last=False)
             return entity
         except Exception as e:
             logger.error(f"Failed to get entity for {identifier}: {e}")
             return None
     
+    async def get_forward_entity(self) -> Optional[Union[Channel, Chat, User]]:
+        """
+        Get the forward destination entity, resolving it only once.
+        
+        Returns:
+            Forward chat entity or None if it could not be found
+        """
+        if self._forward_entity is None:
+            self._forward_entity = await self.fetch_chat_entity(config.FORWARD_CHAT_ID)
+        return self._forward_entity
+    
+    def _input_peer(self, entity: Union[Channel, Chat, User]) -> Any:
+        """
+        Get the input peer for a chat entity, so requests don't resolve it each time.
+        
+        Args:
+            entity: Chat entity
+            
+        Returns:
+            The cached input peer, or the entity itself if it can't be converted
+            (e.g. a min entity without an access hash)
+        """
+        input_peer = self._input_peers.get(entity.id)
+        if input_peer is None:
+            try:
+                input_peer = self._input_peers[entity.id] = utils.get_input_peer(entity)
+            except TypeError:
+                return entity
+        return input_peer
+    
+    def _input_channel(self, channel: Channel) -> types.InputChannel:
+        """
+        Get the input channel for a channel entity, building it only once.
+        
+        Args:
+            channel: Channel entity
+            
+        Returns:
+            The cached input channel
+        """
+        input_channel = self._input_channels.get(channel.id)
+        if input_channel is None:
+            input_channel = self._input_channels[channel.id] = types.InputChannel(channel.id, channel.access_hash)
+        return input_channel
+    
+    def _get_chat_type(self, chat_id: int) -> Optional[str]:
+        """
+        Get the saved type of a chat, caching it since a chat's type never changes.
+        
+        Args:
+            chat_id: ID of the chat
+            
+        Returns:
+            The chat type or None if the chat has no saved state
+        """
+        chat_type = self._chat_types.get(chat_id)
+        if chat_type is None:
+            chat_type = self.state_manager.get_chat_type(chat_id)
+            if chat_type is not None:
+                self._chat_types[chat_id] = chat_type
+        return chat_type
+    
     async def initialize_chat(self, chat_entity: Union[Channel, Chat, User]) -> None:
         """
         Initialize a chat's state if not already initialized.
@@ -85,7 +296,7 @@ class TelegramForwarder:
         chat_type = self.state_manager.determine_chat_type(chat_entity)
         
         # If we already have state for this chat, use it
-        if self.state_manager.get_chat_type(chat_id) is not None:
+        if self._get_chat_type(chat_id) is not None:
             logger.info(f"Using saved state for {chat_type} {chat_id}")
             return
             
@@ -93,9 +304,9 @@ class TelegramForwarder:
         if chat_type == 'channel':
             # For channels, we need the PTS value
             try:
-                full_channel = await self.client(functions.channels.GetFullChannelRequest(
-                    channel=chat_entity
-                ))
+                full_channel = await self._call_rpc(lambda: self.client(functions.channels.GetFullChannelRequest(
+                    channel=self._input_channel(chat_entity)
+                )))
                 pts = full_channel.full_chat.pts
                 self.state_manager.initialize_chat(chat_id, chat_type, {'pts': pts})
             except Exception as e:
@@ -104,7 +315,7 @@ class TelegramForwarder:
             # For groups, we'll track the last message ID
             try:
                 # Get the most recent message to start tracking from
-                messages = await self.client.get_messages(chat_entity, limit=1)
+                messages = await self._call_rpc(lambda: self.client.get_messages(self._input_peer(chat_entity), limit=1))
                 last_id = messages[0].id if messages else 0
                 self.state_manager.initialize_chat(chat_id, chat_type, {'last_id': last_id})
             except Exception as e:
@@ -115,20 +326,115 @@ class TelegramForwarder:
     
     async def fetch_new_messages(self, chat_entity: Union[Channel, Chat, User]) -> None:
         """
-        Fetch new messages from a chat.
+        Fetch messages that arrived since the saved state of a chat.
         
         Args:
             chat_entity: Chat entity
         """
         chat_id = chat_entity.id
-        chat_type = self.state_manager.get_chat_type(chat_id)
+        chat_type = self._get_chat_type(chat_id)
         
+        fetcher = self._fetchers.get(chat_type)
+        if fetcher is not None:
+            await fetcher(chat_entity)
+        else:
+            logger.warning(f"Unsupported chat type: {chat_type} for chat {chat_id}")
+    
+    async def fetch_all_new_messages(self, chat_entities: List[Union[Channel, Chat, User]]) -> None:
+        """
+        Fetch new messages from several chats concurrently.
+        
+        Args:
+            chat_entities: Chat entities to fetch from
+        """
+        results = await asyncio.gather(
+            *(self.fetch_new_messages(chat_entity) for chat_entity in chat_entities),
+            return_exceptions=True
+        )
+        for chat_entity, result in zip(chat_entities, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error fetching messages from {chat_entity.id}: {result}")
+    
+    async def on_new_message(self, event: events.NewMessage.Event) -> None:
+        """
+        Handle a new message pushed by Telegram for one of the source chats.
+        
+        The message is queued for the workers, waiting while the queue is full.
+        
+        Args:
+            event: NewMessage event
+        """
+        chat_entity = await event.get_chat()
+        chat_type = self._get_chat_type(chat_entity.id)
         if chat_type == 'channel':
-            await self._fetch_channel_difference(chat_entity)
+            position = getattr(event.original_update, 'pts', None)
         elif chat_type == 'group':
-            await self._fetch_group_messages(chat_entity)
+            position = event.message.id
         else:
-            logger.warning(f"Unsupported chat type: {chat_type} for chat {chat_id}")
+            position = None
+        # Updates arrive one at a time, so positions are registered in increasing order
+        if position is not None:
+            self._positions.setdefault(chat_entity.id, OrderedDict())[position] = False
+        await self._message_queue.put((chat_entity, event.message, position))
+    
+    async def _message_worker(self) -> None:
+        """Process queued new messages one at a time."""
+        while True:
+            chat_entity, message, position = await self._message_queue.get()
+            try:
+                await self.process_new_message(chat_entity, message)
+            except Exception as e:
+                logger.error(f"Error handling new message {message.id} from {chat_entity.id}: {e}")
+            finally:
+                if position is not None:
+                    if message.grouped_id in self.grouped_messages:
+                        self._group_positions.setdefault(message.grouped_id, []).append((chat_entity.id, position))
+                    else:
+                        self._complete_position(chat_entity.id, position)
+                self._message_queue.task_done()
+            try:
+                await self.state_manager.maybe_flush_async()
+            except Exception as e:
+                logger.error(f"Error saving state: {e}")
+    
+    async def _state_flush_loop(self) -> None:
+        """Periodically save changed chat states and message hashes."""
+        while True:
+            await asyncio.sleep(STATE_FLUSH_INTERVAL)
+            try:
+                await self.state_manager.maybe_flush_async(STATE_FLUSH_INTERVAL)
+            except Exception as e:
+                logger.error(f"Error saving state: {e}")
+    
+    def _complete_position(self, chat_id: int, position: int) -> None:
+        """
+        Mark a new message as handled and move the chat's saved position past every
+        message handled so far without a gap, so the startup catch-up doesn't refetch them.
+        
+        Args:
+            chat_id: ID of the source chat
+            position: pts (channels) or message ID (groups) of the message
+        """
+        positions = self._positions.get(chat_id)
+        if positions is None or position not in positions:
+            return
+        positions[position] = True
+        
+        handled = None
+        while positions and next(iter(positions.values())):
+            handled, _ = positions.popitem(last=False)
+        if handled is None:
+            return
+        
+        # The startup catch-up may already have moved the position further
+        key = 'pts' if self._get_chat_type(chat_id) == 'channel' else 'last_id'
+        if handled > (self.state_manager.get_chat_state(chat_id, key) or 0):
+            self.state_manager.update_chat_state(chat_id, {key: handled})
+    
+    def _complete_group_positions(self, group_id: int) -> None:
+        """Mark the new messages of a processed or dropped media group as handled."""
+        for chat_id, position in self._group_positions.pop(group_id, ()):
+            self._complete_position(chat_id, position)
     
     async def _fetch_channel_difference(self, channel: Channel) -> None:
         """
@@ -143,13 +449,13 @@ class TelegramForwarder:
                 logger.error(f"No PTS found for channel {channel.id}")
                 return
                 
-            result = await self.client(functions.updates.GetChannelDifferenceRequest(
-                channel=types.InputChannel(channel.id, channel.access_hash),
+            result = await self._call_rpc(lambda: self.client(functions.updates.GetChannelDifferenceRequest(
+                channel=self._input_channel(channel),
                 filter=types.ChannelMessagesFilterEmpty(),
                 pts=pts,
                 limit=100,
                 force=True
-            ))
+            )))
 
             # Check the type of result to handle different response types
             if hasattr(result, 'new_messages'):
@@ -157,8 +463,11 @@ class TelegramForwarder:
                 for message in result.new_messages:
                     await self.process_new_message(channel, message)
 
-            # Update the state variables - pts should be available in all response types
-            self.state_manager.update_chat_state(channel.id, {'pts': result.pts})
+            # Update the state variables - pts should be available in all response types.
+            # The live handler may have moved pts further while we were processing
+            if result.pts > (self.state_manager.get_chat_state(channel.id, 'pts') or 0):
+                self.state_manager.update_chat_state(channel.id, {'pts': result.pts})
+            await self.state_manager.maybe_flush_async()
             
         except FloodWaitError as e:
             logger.warning(f"Rate limited. Waiting for {e.seconds} seconds.")
@@ -177,11 +486,11 @@ class TelegramForwarder:
             last_id = self.state_manager.get_chat_state(group.id, 'last_id') or 0
             
             # Get messages newer than the last processed ID
-            messages = await self.client.get_messages(
-                group,
+            messages = await self._call_rpc(lambda: self.client.get_messages(
+                self._input_peer(group),
                 limit=100,  # Adjust as needed
                 min_id=last_id
-            )
+            ))
             
             if not messages:
                 return
@@ -190,9 +499,12 @@ class TelegramForwarder:
             for message in reversed(messages):
                 await self.process_new_message(group, message)
                 
-            # Update the last message ID
-            new_last_id = max(msg.id for msg in messages)
-            self.state_manager.update_chat_state(group.id, {'last_id': new_last_id})
+            # Update the last message ID. get_messages returns newest first, and the
+            # live handler may have moved last_id further while we were processing
+            new_last_id = messages[0].id
+            if new_last_id > (self.state_manager.get_chat_state(group.id, 'last_id') or 0):
+                self.state_manager.update_chat_state(group.id, {'last_id': new_last_id})
+            await self.state_manager.maybe_flush_async()
             
         except FloodWaitError as e:
             logger.warning(f"Rate limited. Waiting for {e.seconds} seconds.")
@@ -212,8 +524,15 @@ class TelegramForwarder:
             # Generate hash for this message
             message_hash = self.state_manager.generate_message_hash(message)
             
-            # Check if we've already processed this message
-            if self.state_manager.is_hash_in_store(message_hash):
+            # Check if we've already processed this message. Grouped messages are only
+            # added to the store once their whole group has been handled; other messages
+            # are claimed right away so a concurrent copy of the same content is skipped
+            if message.grouped_id:
+                already_processed = self.state_manager.is_hash_in_store(message_hash)
+            else:
+                already_processed = await self.state_manager.check_and_add_async(message_hash)
+            if already_processed:
+                MESSAGES_PROCESSED.labels(outcome="duplicate").inc()
                 logger.debug(f"Message {message.id} already processed (hash in store). Skipping.")
                 return
                 
@@ -221,82 +540,218 @@ class TelegramForwarder:
                 # This message is part of a media group/album
                 group_id = message.grouped_id
                 
-                if group_id not in self.grouped_messages:
-                    self.grouped_messages[group_id] = []
-                    
-                self.grouped_messages[group_id].append((message, message_hash))
+                # A group is collected and scheduled in the same step with no await in
+                # between, so concurrent handlers can't schedule the same group twice
+                group = self.grouped_messages.get(group_id)
+                if group is None:
+                    if len(self.grouped_messages) >= MAX_PENDING_GROUPS:
+                        self._drop_oldest_group()
+                    group = self.grouped_messages[group_id] = []
+                    # Schedule this group to be processed after a delay (to collect all messages)
+                    deadline = asyncio.get_running_loop().time() + config.GROUP_PROCESSING_DELAY
+                    self._group_deadlines[group_id] = (deadline, chat_entity)
+                    self._group_wake.set()
                 
-                # Start a task to process this group after a delay (to collect all messages)
-                if group_id not in self.processing_groups:
-                    self.processing_groups.add(group_id)
-                    asyncio.create_task(self.process_group_after_delay(chat_entity, group_id))
+                # The same message can arrive from both the live handler and the startup catch-up
+                if any(queued.id == message.id for queued, _ in group):
+                    return
+                    
+                group.append((message, message_hash))
             else:
                 # Regular non-grouped message
                 message_content = message.message or ""
-                if self.ai_filter.is_content_interesting(message_content):
-                    forward_chat_entity = await self.fetch_chat_entity(config.FORWARD_CHAT_ID)
-                    if forward_chat_entity:
-                        await self.client.forward_messages(forward_chat_entity, message, chat_entity)
-                        # Add hash to store after successful forwarding
-                        self.state_manager.add_hash_to_store(message_hash)
-                        logger.info(f"Forwarded message {message.id} from {chat_entity.id} to {forward_chat_entity.id}")
+                forwarded = False
+                try:
+                    if await self.ai_filter.is_content_interesting(message_content):
+                        forward_chat_entity = await self.get_forward_entity()
+                        if forward_chat_entity:
+                            await self._forward_messages(forward_chat_entity, message, chat_entity)
+                            forwarded = True
+                            MESSAGES_PROCESSED.labels(outcome="forwarded").inc()
+                            logger.info(f"Forwarded message {message.id} from {chat_entity.id} to {forward_chat_entity.id}")
+                        else:
+                            logger.error(f"Could not find forward chat with ID {config.FORWARD_CHAT_ID}")
                     else:
-                        logger.error(f"Could not find forward chat with ID {config.FORWARD_CHAT_ID}")
-                else:
-                    logger.info(f"Message {message.id} filtered out as not interesting")
+                        MESSAGES_PROCESSED.labels(outcome="filtered").inc()
+                        logger.info(f"Message {message.id} filtered out as not interesting")
+                finally:
+                    # Only forwarded content is kept in the store, so release the claim otherwise
+                    if not forwarded:
+                        self.state_manager.discard_hash(message_hash)
         except Exception as e:
             logger.error(f"Failed to process message {message.id}: {e}")
     
-    async def process_group_after_delay(self, chat_entity: Union[Channel, Chat, User], group_id: int, delay_seconds: int = None) -> None:
+    async def _retry_rpc(self, request: Callable[[], Awaitable[Any]], max_attempts: int = MAX_RPC_ATTEMPTS, base_delay: float = 1.0) -> Any:
+        """
+        Run a Telegram request, retrying it with exponential backoff on flood waits.
+        
+        Args:
+            request: Function that starts the request and returns its awaitable
+            max_attempts: Maximum number of attempts
+            base_delay: Backoff delay in seconds before the second attempt
+            
+        Returns:
+            The result of the request
+            
+        Raises:
+            FloodWaitError: If every attempt was rate limited or the required
+                wait is longer than MAX_FLOOD_WAIT seconds
+        """
+        for attempt in range(max_attempts):
+            try:
+                return await request()
+            except FloodWaitError as e:
+                delay = max(e.seconds, base_delay * 2 ** attempt)
+                if attempt + 1 >= max_attempts or delay > MAX_FLOOD_WAIT:
+                    raise
+                logger.warning(f"Rate limited. Retrying in {delay} seconds (attempt {attempt + 1}/{max_attempts}).")
+                await asyncio.sleep(delay)
+    
+    async def _call_rpc(self, request: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run a Telegram request within the concurrent request limit, retrying flood waits.
+        
+        Args:
+            request: Function that starts the request and returns its awaitable
+            
+        Returns:
+            The result of the request
+        """
+        async def limited():
+            async with self._rpc_sem:
+                return await request()
+        
+        return await self._retry_rpc(limited)
+    
+    async def _forward_messages(self, forward_chat_entity: Union[Channel, Chat, User], messages: Union[Message, List[Message]], chat_entity: Union[Channel, Chat, User]) -> None:
         """
-        Process a group of messages after collecting them for a short time.
+        Forward one or more messages, respecting the forward rate and retrying on flood waits.
         
         Args:
+            forward_chat_entity: Destination chat entity
+            messages: Message or list of messages to forward together
             chat_entity: Source chat entity
-            group_id: Group ID of the messages
-            delay_seconds: Delay in seconds before processing (defaults to config value)
         """
-        if delay_seconds is None:
-            delay_seconds = config.GROUP_PROCESSING_DELAY
+        to_peer = self._input_peer(forward_chat_entity)
+        from_peer = self._input_peer(chat_entity)
+        
+        async def forward():
+            await self._forward_limiter.acquire()
+            async with self._rpc_sem:
+                return await self.client.forward_messages(to_peer, messages, from_peer)
+        
+        await self._retry_rpc(forward)
+    
+    async def _group_coalescer_loop(self) -> None:
+        """Process each pending media group once its collection delay has passed."""
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._group_deadlines:
+                self._group_wake.clear()
+                await self._group_wake.wait()
+                continue
+            
+            # The oldest group is always due first, since groups added later have later deadlines
+            group_id, (deadline, chat_entity) = next(iter(self._group_deadlines.items()))
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
             
-        await asyncio.sleep(delay_seconds)  # Wait to collect all messages in group
+            # Wait for a free slot before taking the group, so it can still be dropped meanwhile
+            await self._group_slots.acquire()
+            if self._group_deadlines.pop(group_id, None) is None:
+                self._group_slots.release()
+                continue
+            self._start_group(chat_entity, group_id)
+    
+    def _start_group(self, chat_entity: Union[Channel, Chat, User], group_id: int) -> None:
+        """Process a media group in its own task, using a slot already taken from _group_slots."""
+        task = asyncio.create_task(self._process_due_group(chat_entity, group_id))
+        self._group_tasks.add(task)
+        task.add_done_callback(self._on_group_done)
+    
+    async def _process_due_group(self, chat_entity: Union[Channel, Chat, User], group_id: int) -> None:
+        """Process a media group and only then count its messages as handled."""
+        try:
+            await self.process_group(chat_entity, group_id)
+        finally:
+            self._complete_group_positions(group_id)
+        await self.state_manager.maybe_flush_async()
+    
+    def _on_group_done(self, task: asyncio.Task) -> None:
+        """Free the slot of a finished media group task."""
+        self._group_tasks.discard(task)
+        self._group_slots.release()
+    
+    def _drop_oldest_group(self) -> None:
+        """Discard the oldest pending media group to keep the number of collected groups bounded."""
+        group_id = next(iter(self.grouped_messages))
+        message_tuples = self.grouped_messages.pop(group_id)
+        self._group_deadlines.pop(group_id, None)
+        self._complete_group_positions(group_id)
+        logger.warning(f"Too many pending media groups. Dropped group {group_id} with {len(message_tuples)} messages.")
+    
+    async def process_group(self, chat_entity: Union[Channel, Chat, User], group_id: int) -> None:
+        """
+        Process a group of messages once all of them have been collected.
+        
+        Args:
+            chat_entity: Source chat entity
+            group_id: Group ID of the messages
+        """
+        # Take the group out before anything can fail so its messages are never left behind
+        message_tuples = self.grouped_messages.pop(group_id, None)
+        if message_tuples is None:
+            return
         
         try:
-            if group_id not in self.grouped_messages:
-                return
-                
-            message_tuples = self.grouped_messages[group_id]
-            del self.grouped_messages[group_id]
-            self.processing_groups.remove(group_id)
-            
             # Extract content from all messages in the group
-            messages_content = ""
-            for msg, _ in message_tuples:
-                if hasattr(msg, 'message') and msg.message:
-                    messages_content += msg.message + " "
-                elif hasattr(msg, 'caption') and msg.caption:
-                    messages_content += msg.caption + " "
+            messages_contents = [
+                text for text in (getattr(msg, 'message', None) or getattr(msg, 'caption', None) for msg, _ in message_tuples)
+                if text
+            ]
             
-            logger.debug(f"Processing group with {len(message_tuples)} messages. Content: {messages_content.strip()[:100]}...")
+            # Only join the texts for the preview when debug logging is on
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Processing group with {len(message_tuples)} messages. Content: {' '.join(messages_contents)[:100]}...")
             
             # Check if any message in the group is already in hash store
-            group_already_processed = any(self.state_manager.is_hash_in_store(msg_hash) for _, msg_hash in message_tuples)
+            message_hashes = [msg_hash for _, msg_hash in message_tuples]
+            group_already_processed = bool(self.state_manager.are_hashes_in_store(message_hashes))
             
-            if not group_already_processed and self.ai_filter.is_content_interesting(messages_content):
-                forward_chat_entity = await self.fetch_chat_entity(config.FORWARD_CHAT_ID)
+            if not group_already_processed and await self._is_group_interesting(messages_contents):
+                forward_chat_entity = await self.get_forward_entity()
                 if forward_chat_entity:
-                    for message, message_hash in message_tuples:
-                        await self.client.forward_messages(forward_chat_entity, message, chat_entity)
-                        # Add hash to store after successful forwarding
-                        self.state_manager.add_hash_to_store(message_hash)
-                        logger.info(f"Forwarded grouped message {message.id} to {forward_chat_entity.id}")
+                    # Forward the whole group in one request so it stays an album at the destination
+                    messages = [message for message, _ in message_tuples]
+                    await self._forward_messages(forward_chat_entity, messages, chat_entity)
+                    # Add hashes to store after successful forwarding
+                    await self.state_manager.add_hashes_to_store_async(message_hashes)
+                    MESSAGES_PROCESSED.labels(outcome="forwarded").inc(len(message_tuples))
+                    logger.info(f"Forwarded media group {group_id} ({len(messages)} messages) to {forward_chat_entity.id}")
                 else:
                     logger.error(f"Could not find forward chat with ID {config.FORWARD_CHAT_ID}")
             elif group_already_processed:
+                MESSAGES_PROCESSED.labels(outcome="duplicate").inc(len(message_tuples))
                 logger.debug(f"Media group {group_id} already processed (hash in store). Skipping.")
             else:
+                MESSAGES_PROCESSED.labels(outcome="filtered").inc(len(message_tuples))
                 logger.info(f"Media group {group_id} filtered out as not interesting")
         except Exception as e:
             logger.error(f"Error processing message group {group_id}: {e}")
-            if group_id in self.processing_groups:
-                self.processing_groups.remove(group_id)
+    
+    async def _is_group_interesting(self, messages_contents: List[str]) -> bool:
+        """
+        Classify the texts of a media group with a single batched AI filter call.
+        
+        Args:
+            messages_contents: Non-empty texts/captions of the messages in the group
+            
+        Returns:
+            bool: True if any message in the group is interesting (or the group has no text)
+        """
+        if not messages_contents:
+            logger.debug("Media group has no text, defaulting to True")
+            return True
+        return any(await self.ai_filter.classify_many(messages_contents))